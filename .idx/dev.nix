@@ -8,10 +8,9 @@
   packages = [
     pkgs.python311
     pkgs.python311Packages.pip
-    pkgs.pandoc
-    pkgs.poppler_utils
     pkgs.python311Packages.flask
     pkgs.python311Packages.pymupdf
+    pkgs.python311Packages.python-docx
   ];
 
   # Sets environment variables in the workspace
@@ -8,8 +8,7 @@ PDF text, classify and reorder the files, merge them into grouped and combined
 PDFs, generate DOCX dispatches, and return a ZIP archive with all files.
 
 Dependencies:
- - Flask, PyMuPDF
- - Pandoc and pdfunite must be available in the system path.
+ - Flask, PyMuPDF, python-docx
 
 Usage:
     python app.py
@@ -19,15 +18,32 @@ After running, open http://localhost:5000/ in a browser to use the app.
 import os
 import re
 import tempfile
-import subprocess
 import zipfile
 import unicodedata
+import functools
+from collections import namedtuple
+from operator import attrgetter
 from datetime import datetime
 import locale
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from werkzeug.formparser import parse_form_data
 import fitz  # PyMuPDF
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Pt
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 500 * 1024
+ZIP_CHUNK_SIZE = 1024 * 1024
+REPORT_NAME = "_relatorio_de_verificacao.txt"
+STORED_EXTENSIONS = ('.pdf', '.docx')
+# The form fields live on the cover pages (ofício, demonstrativo headers); later pages are never needed.
+FORM_DATA_PAGES = 3
+FORM_FIELDS = ('tipo_pdde', 'ano', 'escola', 'presidente', 'processo', 'cnpj')
+# Plain text only: whitespace must survive for the \s-based patterns, text outside the page
+# is skipped, and ligature expansion / CID substitution are skipped.
+FORM_TEXT_FLAGS = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
 
 # Set locale to Portuguese (Brazil) for date formatting
 try:
@@ -39,72 +55,197 @@ except locale.Error:
 def health():
     return jsonify(status="ok"), 200
 
+# The accented letters that occur in Portuguese names; anything else non-ASCII takes the
+# full NFKD round trip.
+_ACCENT_MAP = str.maketrans(
+    'áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ',
+    'aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN',
+)
+
+def ascii_fold(value: str) -> str:
+    value = value.translate(_ACCENT_MAP)
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value).encode('ASCII', 'ignore').decode()
+    return value
+
+_SLUG_RE = re.compile(r'[^A-Za-z0-9_]')
+_SLUG_SEPARATORS = str.maketrans(' -', '__')
+
+@functools.lru_cache(maxsize=256)
 def slugify(value: str) -> str:
     if not value: return ''
-    value_norm = unicodedata.normalize('NFKD', value).encode('ASCII', 'ignore').decode()
-    value_norm = value_norm.replace(' ', '_').replace('-', '_')
-    return ''.join(ch for ch in value_norm if ch.isalnum() or ch == '_').lower()
-
+    return _SLUG_RE.sub('', ascii_fold(value).translate(_SLUG_SEPARATORS)).lower()
+
+_ORDER_DEFINITIONS = [
+    (1, ['oficio']), (2, ['demonstrativo']), (3, ['conciliacao']),
+    (4, ['extrato conta corrente', 'extratos conta corrente', 'conta_corrente']),
+    (5, ['extrato aplicacao', 'extratos aplicacao', 'extratos aplicacoes', 'aplicacao']),
+    (6, ['nf', 'nota', 'comprovante', 'comprovantes', 'orcamento', 'orcamentos', 'pagamento']),
+    (7, ['consolidacao', 'pesquisa']), (8, ['planejamento', 'ata']),
+    (9, ['bb agil', 'bb_agil', 'declaracao', 'agil']), (10, ['parecer']),
+    (11, ['justificativa'])
+]
+# One named group per priority, wrapped in a lookahead so every position is tried: the
+# lowest index found anywhere in the name wins, not merely the leftmost keyword.
+_ORDER_RE = re.compile('(?=' + '|'.join(
+    f"(?P<g{idx}>{'|'.join(re.escape(kw.replace(' ', '')) for kw in keywords)})"
+    for idx, keywords in _ORDER_DEFINITIONS
+) + ')')
+
+FileInfo = namedtuple('FileInfo', 'path base idx')
+
+@functools.lru_cache(maxsize=4096)
 def determine_order_index(filename: str) -> int:
-    name = filename.lower()
-    name_norm = unicodedata.normalize('NFKD', name).encode('ASCII', 'ignore').decode()
-    order_definitions = [
-        (1, ['oficio']), (2, ['demonstrativo']), (3, ['conciliacao']),
-        (4, ['extrato conta corrente', 'extratos conta corrente', 'conta_corrente']),
-        (5, ['extrato aplicacao', 'extratos aplicacao', 'extratos aplicacoes', 'aplicacao']),
-        (6, ['nf', 'nota', 'comprovante', 'comprovantes', 'orcamento', 'orcamentos', 'pagamento']),
-        (7, ['consolidacao', 'pesquisa']), (8, ['planejamento', 'ata']),
-        (9, ['bb agil', 'bb_agil', 'declaracao', 'agil']), (10, ['parecer']),
-        (11, ['justificativa'])
-    ]
-    for idx, keywords in order_definitions:
-        for kw in keywords:
-            if kw.replace(' ', '') in name_norm.replace(' ', ''):
-                return idx
-    return 100
-
-def extract_text_from_pdfs(file_paths):
-    full_text = ''
-    for path in file_paths:
-        try:
-            with fitz.open(path) as doc:
-                for page in doc:
-                    full_text += page.get_text("text") + '\n\n'
-        except Exception as e:
-            print(f"Error reading {path}: {e}")
-    return full_text
-
-def extract_form_data(text: str):
-    data = {
-        'tipo_pdde': None, 'ano': None, 'escola': None,
-        'presidente': None, 'processo': None, 'cnpj': None
-    }
+    name_norm = ascii_fold(filename.lower()).replace(' ', '')
+    return min((int(m.lastgroup[1:]) for m in _ORDER_RE.finditer(name_norm)), default=100)
+
+def update_form_data(form_data, doc):
+    # Fills only the fields still missing, one page at a time, and stops reading pages as
+    # soon as every field is known. A damaged page only costs this file's form fields.
+    try:
+        for page in doc.pages(0, min(FORM_DATA_PAGES, doc.page_count)):
+            if all(form_data.values()): return
+            extract_form_data(page.get_text("text", flags=FORM_TEXT_FLAGS, sort=False), form_data)
+    except Exception as e:
+        print(f"Error reading {doc.name}: {e}")
+
+# Single-capture fields found in the normalized upper-case text, matched in one pass. Only
+# the processo alternative consumes text, and it comes first, so its digits are never
+# mistaken for a CNPJ. The others are lookaheads: a match for one field never hides the
+# start of another, so each still finds its first occurrence.
+_FIELDS_RE = re.compile(
+    r'(?P<processo>\d{7}\.\d{6}/\d{4}-\d{2})'
+    r'|(?=(?P<cnpj>\d{2}[.\s]?\d{3}[.\s]?\d{3}[/\s]?\d{4}[-\s]?\d{2}))'
+    r'|(?=EXERC[IÍ]CIO[:\s]+(?P<ano>\d{4}))'
+    r'|(?=PDDE\s+(?P<tipo_pdde>B[AÁ]SICO|QUALIDADE|EQUIDADE))'
+)
+_FIELDS = _FIELDS_RE.groupindex.keys()
+# Both school-name forms in one pass over the original text (it keeps case and line
+# breaks). Lookaheads let overlapping candidates match; the razão social form wins
+# wherever it appears, the CEC form is the fallback.
+_ESCOLA_RE = re.compile(
+    r'(?=NOME DA RAZ[AÃ]O SOCIAL\s+(?:CEC DA\s+)?(?P<razao_social>.+?)(?:,|\n|Processo:))'
+    r'|(?=CONSELHO ESCOLAR COMUNIT[AÁ]RIO \(CEC\) DA (?P<cec>.+?)(?:,|\n|Processo:))',
+    re.I,
+)
+_ESCOLA_PREFIX_RE = re.compile(r'^(CRECHE MUNICIPAL|C M|E M|EDI|ESCOLAR MUNICIPAL)\s+', re.I)
+_PRESIDENTE_RE = re.compile(r'(?:PRESIDENTE(?: DO CEC)?|ASSINATURA)[:\s,]+([A-Z\s]{5,})(?=\n)')
+
+def extract_form_data(text: str, data=None):
+    # Fills only the fields of data that are still missing, cheapest scans first, and skips
+    # any scan whose fields are already known.
+    if data is None:
+        data = dict.fromkeys(FORM_FIELDS)
     text_norm = ' '.join(text.split()).upper()
 
-    if match := re.search(r'(\d{2}[.\s]?\d{3}[.\s]?\d{3}[/\s]?\d{4}[-\s]?\d{2})', text_norm):
-        data['cnpj'] = match.group(1)
-    if match := re.search(r'EXERC[IÍ]CIO[:\s]+(\d{4})', text_norm):
-        data['ano'] = match.group(1)
-    if match := re.search(r'PDDE\s+(B[AÁ]SICO|QUALIDADE|EQUIDADE)', text_norm):
-        data['tipo_pdde'] = match.group(1)
-    if match := re.search(r'NOME DA RAZ[AÃ]O SOCIAL\s+(?:CEC DA\s+)?(.+?)(?:,|\n|Processo:)', text, re.I):
-        escola = match.group(1).strip()
-        data['escola'] = re.sub(r'^(CRECHE MUNICIPAL|C M|E M|EDI|ESCOLAR MUNICIPAL)\s+', '', escola, flags=re.I).strip()
-    elif match := re.search(r'CONSELHO ESCOLAR COMUNIT[AÁ]RIO \(CEC\) DA (.+?)(?:,|\n|Processo:)', text, re.I):
-        escola = match.group(1).strip()
-        data['escola'] = re.sub(r'^(CRECHE MUNICIPAL|C M|E M|EDI|ESCOLAR MUNICIPAL)\s+', '', escola, flags=re.I).strip()
-    if match := re.search(r'(?:PRESIDENTE(?: DO CEC)?|ASSINATURA)[:\s,]+([A-Z\s]{5,})(?=\n)', text_norm):
-        data['presidente'] = match.group(1).strip()
-    if match := re.search(r'(\d{7}\.\d{6}/\d{4}-\d{2})', text_norm):
-        data['processo'] = match.group(1)
+    if not all(data[field] for field in _FIELDS):
+        for match in _FIELDS_RE.finditer(text_norm):
+            if not data[match.lastgroup]:
+                data[match.lastgroup] = match.group(match.lastgroup)
+                if all(data[field] for field in _FIELDS): break
+        if all(data.values()): return data
+    if not data['escola']:
+        escolas = {}
+        for match in _ESCOLA_RE.finditer(text):
+            escolas.setdefault(match.lastgroup, match.group(match.lastgroup))
+            if 'razao_social' in escolas: break
+        if escola := escolas.get('razao_social') or escolas.get('cec'):
+            data['escola'] = _ESCOLA_PREFIX_RE.sub('', escola.strip()).strip()
+        if all(data.values()): return data
+    if not data['presidente']:
+        if match := _PRESIDENTE_RE.search(text_norm):
+            data['presidente'] = match.group(1).strip()
     return data
 
-def merge_pdfs(file_list, output_path):
-    if not file_list: return
-    subprocess.run(['pdfunite'] + file_list + [output_path], check=True)
-
-def create_dispatch_html(tipo_pdde, ano, escola, presidente, processo, cnpj):
-    p_style = "text-align: justify; line-height: 1.5; font-family: Arial, sans-serif; font-size: 12pt;"
+def open_upload(path):
+    # Returns (doc, None), or (None, reason) for an upload that cannot go into the package;
+    # the reason is shown to the user in the verification report.
+    try:
+        doc = fitz.open(path)
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        return None, "não foi possível abrir o PDF (arquivo corrompido ou inválido)"
+    if doc.needs_pass:
+        print(f"Skipping password-protected {path}")
+        doc.close()
+        return None, "PDF protegido por senha"
+    return doc, None
+
+def upload_stream_factory(uploads_dir):
+    # Werkzeug writes each file part straight into the returned stream, so PDFs land
+    # in uploads_dir without an intermediate SpooledTemporaryFile and a second copy.
+    def factory(total_content_length, content_type, filename, content_length=None):
+        name = os.path.basename(filename or '')
+        if name.lower().endswith('.pdf'):
+            return open(os.path.join(uploads_dir, name), 'w+b')
+        return tempfile.TemporaryFile(dir=uploads_dir)
+    return factory
+
+class ZipChunkBuffer:
+    # Unseekable sink for ZipFile: collects written bytes until stream_zip yields them.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries, workdir):
+    # entries are (path, arcname) pairs in archive order. The working directory must outlive
+    # the request handler, so cleanup happens here once the archive has been fully sent (or
+    # the client has gone away).
+    buffer = ZipChunkBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+            for path, item in entries:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname=item)
+                # PDFs and DOCX files are already deflated internally; anything else (the text
+                # report) is worth compressing.
+                if not item.lower().endswith(STORED_EXTENSIONS):
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, zf.open(zinfo, 'w') as dst:
+                    while chunk := src.read(ZIP_CHUNK_SIZE):
+                        dst.write(chunk)
+                        if data := buffer.drain(): yield data
+        if data := buffer.drain(): yield data
+    finally:
+        workdir.cleanup()
+
+def new_dispatch_document():
+    doc = Document()
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(12)
+    return doc
+
+def add_paragraph(doc, *runs, align=None):
+    # Each run is either plain text or a (text, bold) pair.
+    paragraph = doc.add_paragraph()
+    for run in runs:
+        text, bold = (run, False) if isinstance(run, str) else run
+        paragraph.add_run(text).bold = bold
+    if align == 'justify':
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        paragraph.paragraph_format.line_spacing = 1.5
+    elif align == 'center':
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    return paragraph
+
+def add_signature(doc, *lines):
+    for _ in range(3): doc.add_paragraph()
+    add_paragraph(doc, '_________________________________________', align='center')
+    for line in lines:
+        add_paragraph(doc, line, align='center')
+
+def create_dispatch_docx(tipo_pdde, ano, escola, presidente, processo, cnpj):
     tipo_pdde_str = tipo_pdde or '[TIPO NÃO ENCONTRADO]'
     ano_str = ano or '[ANO NÃO ENCONTRADO]'
     escola_str = escola or '[ESCOLA NÃO ENCONTRADA]'
@@ -113,31 +254,26 @@ def create_dispatch_html(tipo_pdde, ano, escola, presidente, processo, cnpj):
     cnpj_str = cnpj or '[CNPJ NÃO ENCONTRADO]'
 
     # 1. Ofício de Encaminhamento (Escola -> CRE)
-    dispatch1 = f'''<!DOCTYPE html><html lang="pt-BR"><head><meta charset="UTF-8"><title>Ofício de Encaminhamento</title></head><body style="font-family: Arial, sans-serif; font-size: 12pt;">
-        <p>Ao(À) S.r.(a). Coordenador(a) da E/ 4ª CRE</p>
-        <p><strong>Assunto:</strong> Prestação de Contas – FNDE/ PDDE {tipo_pdde_str}/{ano_str}</p><br>
-        <p style="{p_style}">Encaminho, em conformidade com as normas em vigor, a Prestação de Contas dos recursos recebidos por este Conselho Escolar Comunitário - CEC, em razão do Programa PDDE {tipo_pdde_str}/{ano_str}.</p>
-        <br><br><br>
-        <p style="text-align: center;">_________________________________________</p>
-        <p style="text-align: center;">{presidente_str}</p>
-        <p style="text-align: center;">Presidente do CEC</p>
-    </body></html>'''
+    dispatch1 = new_dispatch_document()
+    add_paragraph(dispatch1, 'Ao(À) S.r.(a). Coordenador(a) da E/ 4ª CRE')
+    add_paragraph(dispatch1, ('Assunto:', True), f' Prestação de Contas – FNDE/ PDDE {tipo_pdde_str}/{ano_str}')
+    dispatch1.add_paragraph()
+    add_paragraph(dispatch1, f'Encaminho, em conformidade com as normas em vigor, a Prestação de Contas dos recursos recebidos por este Conselho Escolar Comunitário - CEC, em razão do Programa PDDE {tipo_pdde_str}/{ano_str}.', align='justify')
+    add_signature(dispatch1, presidente_str, 'Presidente do CEC')
 
     # 2. Informação Técnica (Analista -> Coordenador)
-    dispatch2 = f'''<!DOCTYPE html><html lang="pt-BR"><head><meta charset="UTF-8"><title>Informação Técnica</title></head><body style="font-family: Arial, sans-serif; font-size: 12pt;">
-        <p>À Srª COORDENADORA DA 4ª CRE,</p><br>
-        <p style="{p_style}">Após análise da documentação apresentada, informo que a prestação de contas referente ao Programa Dinheiro Direto na Escola – PDDE {tipo_pdde_str}/{ano_str}, vinculada ao Conselho Escolar Comunitário (CEC) da {escola_str}, inscrito no CNPJ sob o nº {cnpj_str}, sob a presidência de {presidente_str}, encontra-se em condições de aprovação, por atender às normatizações e orientações vigentes do Fundo Nacional de Desenvolvimento da Educação – FNDE, aplicáveis à matéria.</p>
-    </body></html>'''
+    dispatch2 = new_dispatch_document()
+    add_paragraph(dispatch2, 'À Srª COORDENADORA DA 4ª CRE,')
+    dispatch2.add_paragraph()
+    add_paragraph(dispatch2, f'Após análise da documentação apresentada, informo que a prestação de contas referente ao Programa Dinheiro Direto na Escola – PDDE {tipo_pdde_str}/{ano_str}, vinculada ao Conselho Escolar Comunitário (CEC) da {escola_str}, inscrito no CNPJ sob o nº {cnpj_str}, sob a presidência de {presidente_str}, encontra-se em condições de aprovação, por atender às normatizações e orientações vigentes do Fundo Nacional de Desenvolvimento da Educação – FNDE, aplicáveis à matéria.', align='justify')
 
     # 3. Despacho de Aprovação (Coordenador)
-    dispatch3 = f'''<!DOCTYPE html><html lang="pt-BR"><head><meta charset="UTF-8"><title>Despacho de Aprovação</title></head><body style="font-family: Arial, sans-serif; font-size: 12pt;">
-        <p><strong>DESPACHO DA COORDENADORIA</strong></p><br>
-        <p style="{p_style}">De acordo.</p>
-        <p style="{p_style}">Considerando a análise técnica que aponta a regularidade da documentação apresentada pelo CEC da {escola_str}, referente ao PDDE {tipo_pdde_str}/{ano_str} (Processo nº {processo_str}), <strong>aprovo</strong> a prestação de contas em questão.</p>
-        <br><br><br>
-        <p style="text-align: center;">_________________________________________</p>
-        <p style="text-align: center;">Coordenador(a) da 4ª CRE</p>
-    </body></html>'''
+    dispatch3 = new_dispatch_document()
+    add_paragraph(dispatch3, ('DESPACHO DA COORDENADORIA', True))
+    dispatch3.add_paragraph()
+    add_paragraph(dispatch3, 'De acordo.', align='justify')
+    add_paragraph(dispatch3, f'Considerando a análise técnica que aponta a regularidade da documentação apresentada pelo CEC da {escola_str}, referente ao PDDE {tipo_pdde_str}/{ano_str} (Processo nº {processo_str}), ', ('aprovo', True), ' a prestação de contas em questão.', align='justify')
+    add_signature(dispatch3, 'Coordenador(a) da 4ª CRE')
 
     return dispatch1, dispatch2, dispatch3
 
@@ -147,38 +283,61 @@ def index():
 
 @app.route('/process', methods=['POST'])
 def process():
-    with tempfile.TemporaryDirectory() as tmpdir:
+    workdir = tempfile.TemporaryDirectory()
+    tmpdir = workdir.name
+    outputs = {}
+    try:
         uploads_dir = os.path.join(tmpdir, 'uploads')
         os.makedirs(uploads_dir, exist_ok=True)
 
+        _, _, uploaded = parse_form_data(
+            request.environ, stream_factory=upload_stream_factory(uploads_dir),
+            max_form_memory_size=app.config['MAX_FORM_MEMORY_SIZE'],
+            max_content_length=app.config['MAX_CONTENT_LENGTH'],
+        )
         files = []
-        for f in request.files.getlist('pdfs'):
-            if f and f.filename.lower().endswith('.pdf'):
-                path = os.path.join(uploads_dir, f.filename)
-                f.save(path)
-                files.append(path)
-        
-        if not files:
-            return "Nenhum PDF enviado.", 400
-
-        full_text = extract_text_from_pdfs(files)
-        form_data = extract_form_data(full_text)
-
-        name_base = f"pdde_{slugify(form_data['tipo_pdde'])}_{slugify(form_data['ano'])}_{slugify(form_data['escola'])}_{slugify(form_data['cnpj'])}"
+        # (filename, reason) for every upload left out of the package.
+        skipped = []
+        for field, f in uploaded.items(multi=True):
+            if field == 'pdfs' and f.filename and f.filename.lower().endswith('.pdf'):
+                # Checked by content too, so a mislabeled upload is reported before PyMuPDF sees it.
+                if f.stream.read(4) == b'%PDF':
+                    files.append(f.stream.name)
+                else:
+                    skipped.append((os.path.basename(f.filename), "o arquivo não é um PDF (cabeçalho %PDF ausente)"))
+            f.close()
 
-        group_files = {1: [], 2: [], 3: []}
+        # Uploads sharing a filename were written to the same path; keep one entry each.
+        infos = sorted(
+            {path: FileInfo(path, (base := os.path.basename(path)), determine_order_index(base)) for path in files}.values(),
+            key=attrgetter('idx', 'base'),
+        )
+        form_data = dict.fromkeys(FORM_FIELDS)
         file_mapping = {1: [], 2: [], 3: [], 'outros': []}
-        combined_order = []
-
-        for path in files:
-            fname = os.path.basename(path)
-            order_index = determine_order_index(fname)
-            if 1 <= order_index <= 5: group_files[1].append(path); file_mapping[1].append(fname)
-            elif 6 <= order_index <= 8: group_files[2].append(path); file_mapping[2].append(fname)
-            else: group_files[3].append(path); file_mapping[3].append(fname)
-            combined_order.append((order_index, path))
+        # Single pass in package order: each upload is opened once, its cover pages feed the
+        # form fields until all are known, and its pages go straight into its group output
+        # and the complete package (key 0). Groups cover disjoint, increasing idx ranges, so
+        # appending in this order keeps every output sorted.
+        for info in infos:
+            doc, reason = open_upload(info.path)
+            if doc is None:
+                skipped.append((info.base, reason))
+                continue
+            with doc:
+                update_form_data(form_data, doc)
+                gnum = 1 if info.idx <= 5 else 2 if info.idx <= 8 else 3
+                for key in (gnum, 0):
+                    if key not in outputs: outputs[key] = fitz.open()
+                    outputs[key].insert_pdf(doc)
+            file_mapping[gnum].append(info.base)
+
+        if not outputs:
+            workdir.cleanup()
+            if skipped:
+                return "Nenhum PDF válido enviado. Arquivos ignorados: " + "; ".join(f"{fname}: {reason}" for fname, reason in skipped), 400
+            return "Nenhum PDF enviado.", 400
 
-        combined_order = [p for _, p in sorted(combined_order, key=lambda x: (x[0], os.path.basename(x[1])))]
+        name_base = f"pdde_{slugify(form_data['tipo_pdde'])}_{slugify(form_data['ano'])}_{slugify(form_data['escola'])}_{slugify(form_data['cnpj'])}"
         outdir = os.path.join(tmpdir, 'out')
         os.makedirs(outdir, exist_ok=True)
 
@@ -187,14 +346,16 @@ def process():
             2: f"02_comprovacao_de_despesas_{name_base}.pdf",
             3: f"03_declaracoes_e_pareceres_{name_base}.pdf",
         }
-        for gnum, paths in group_files.items():
-            if paths:
-                sorted_paths = sorted(paths, key=lambda p: (determine_order_index(os.path.basename(p)), os.path.basename(p)))
-                merge_pdfs(sorted_paths, os.path.join(outdir, group_names[gnum]))
-
-        merge_pdfs(combined_order, os.path.join(outdir, f"00_pacote_completo_{name_base}.pdf"))
+        output_names = {0: f"00_pacote_completo_{name_base}.pdf", **group_names}
+        # Every file destined for the ZIP, in archive order (the numeric name prefixes).
+        produced = []
+        for key, pdf_name in output_names.items():
+            if key in outputs:
+                pdf_path = os.path.join(outdir, pdf_name)
+                outputs[key].save(pdf_path, garbage=3, deflate=True)
+                produced.append((pdf_path, pdf_name))
         
-        dispatch1_html, dispatch2_html, dispatch3_html = create_dispatch_html(
+        dispatches = create_dispatch_docx(
             form_data['tipo_pdde'], form_data['ano'], form_data['escola'], 
             form_data['presidente'], form_data['processo'], form_data['cnpj']
         )
@@ -202,21 +363,18 @@ def process():
         data_por_extenso = datetime.now().strftime("%d de %B de %Y")
         # No need to replace data_por_extenso in templates, but keeping for future use
 
-        html_paths = []
         dispatch_names = [
             f"04_oficio_encaminhamento_{name_base}.docx",
             f"05_informacao_tecnica_{name_base}.docx",
             f"06_despacho_aprovacao_{name_base}.docx"
         ]
-        for i, (html, docx_name) in enumerate(zip([dispatch1_html, dispatch2_html, dispatch3_html], dispatch_names)):
-            html_path = os.path.join(tmpdir, f'despacho_{i+1}.html')
-            with open(html_path, 'w', encoding='utf-8') as hf:
-                hf.write(html)
+        for doc, docx_name in zip(dispatches, dispatch_names):
             docx_path = os.path.join(outdir, docx_name)
-            subprocess.run(['pandoc', html_path, '-f', 'html', '-t', 'docx', '-o', docx_path], check=True)
-            html_paths.append(html_path)
+            doc.save(docx_path)
+            produced.append((docx_path, docx_name))
 
-        report_path = os.path.join(outdir, "_relatorio_de_verificacao.txt")
+        report_path = os.path.join(outdir, REPORT_NAME)
+        produced.append((report_path, REPORT_NAME))
         with open(report_path, 'w', encoding='utf-8') as rf:
             rf.write("-----------------------------------------\n")
             rf.write(" RELATÓRIO DE VERIFICAÇÃO AUTOMÁTICA\n")
@@ -231,17 +389,25 @@ def process():
             for gnum, group_name_key in group_names.items():
                 rf.write(f"\nGrupo {gnum} - {os.path.basename(group_name_key).split('_', 1)[1].rsplit('_', 4)[0].replace('_', ' ')}:\n")
                 if file_mapping.get(gnum):
-                    for fname in sorted(file_mapping[gnum]):
-                        rf.write(f"  - {fname}\n")
+                    rf.write(''.join(f"  - {fname}\n" for fname in sorted(file_mapping[gnum])))
                 else:
                     rf.write("  - Nenhum arquivo nesta categoria.\n")
-
-        zip_path = os.path.join(tmpdir, f'pacote_{name_base}.zip')
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for item in sorted(os.listdir(outdir)):
-                zf.write(os.path.join(outdir, item), arcname=item)
-        
-        return send_file(zip_path, as_attachment=True, download_name=os.path.basename(zip_path))
+            rf.write("\n-----------------------------------------\n\n")
+            rf.write("ARQUIVOS NÃO INCLUÍDOS NO PACOTE:\n")
+            if skipped:
+                rf.write(''.join(f"  - {fname}: {reason}\n" for fname, reason in sorted(skipped)))
+            else:
+                rf.write("  - Nenhum.\n")
+
+        zip_name = f'pacote_{name_base}.zip'
+        return Response(stream_zip(produced, workdir), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={zip_name}'})
+    except BaseException:
+        workdir.cleanup()
+        raise
+    finally:
+        for out in outputs.values():
+            out.close()
 
 # The following lines are not needed for Vercel
 # if __name__ == '__main__':